@@ -20,7 +20,7 @@ import json
 import sqlite3
 
 from itertools import zip_longest
-from typing import Iterable
+from typing import Iterable, Sized
 
 
 def nums_to_numbits(nums: Iterable[int]) -> bytes:
@@ -33,14 +33,30 @@ def nums_to_numbits(nums: Iterable[int]) -> bytes:
         A binary blob.
     """
     try:
-        nbytes = max(nums) // 8 + 1
+        nbits = max(nums) + 1
     except ValueError:
         # nums was empty.
         return b""
-    b = bytearray(nbytes)
+    if not isinstance(nums, Sized) or len(nums) * 16 < nbits:
+        # Sparse numbers: set bits one at a time, so the work doesn't grow
+        # with the largest number.
+        b = bytearray((nbits + 7) // 8)
+        for num in nums:
+            b[num//8] |= 1 << num % 8
+        return bytes(b)
+    # Setting single characters in a string of binary digits is cheaper than
+    # or-ing bits into bytes, and int() packs the digits in C.
+    bits = bytearray(b"0") * nbits
+    one = ord("1")
     for num in nums:
-        b[num//8] |= 1 << num % 8
-    return bytes(b)
+        bits[num] = one
+    bits.reverse()
+    return int(bits, 2).to_bytes((nbits + 7) // 8, "little")
+
+
+# For each possible byte value, the positions of its set bits, so that
+# numbits_to_nums can skip empty bytes and never test bits one at a time.
+_BYTE_BITS = [tuple(i for i in range(8) if byte & (1 << i)) for byte in range(256)]
 
 
 def numbits_to_nums(numbits: bytes) -> list[int]:
@@ -56,12 +72,11 @@ def numbits_to_nums(numbits: bytes) -> list[int]:
     this returns a string, a JSON-encoded list of ints.
 
     """
-    nums = []
-    for byte_i, byte in enumerate(numbits):
-        for bit_i in range(8):
-            if (byte & (1 << bit_i)):
-                nums.append(byte_i * 8 + bit_i)
-    return nums
+    return [
+        byte_i * 8 + bit_i
+        for byte_i, byte in enumerate(numbits) if byte
+        for bit_i in _BYTE_BITS[byte]
+    ]
 
 
 def numbits_union(numbits1: bytes, numbits2: bytes) -> bytes:
@@ -70,8 +85,10 @@ def numbits_union(numbits1: bytes, numbits2: bytes) -> bytes:
     Returns:
         A new numbits, the union of `numbits1` and `numbits2`.
     """
-    byte_pairs = zip_longest(numbits1, numbits2, fillvalue=0)
-    return bytes(b1 | b2 for b1, b2 in byte_pairs)
+    # Or-ing the bytes as one big int does the work in C, not byte by byte.
+    nbytes = max(len(numbits1), len(numbits2))
+    union = int.from_bytes(numbits1, "little") | int.from_bytes(numbits2, "little")
+    return union.to_bytes(nbytes, "little")
 
 
 def numbits_intersection(numbits1: bytes, numbits2: bytes) -> bytes:
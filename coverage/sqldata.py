@@ -5,31 +5,31 @@
 
 from __future__ import annotations
 
+import base64
 import collections
+import contextlib
 import datetime
 import functools
-import glob
 import itertools
 import os
-import random
+import re
 import socket
 import sqlite3
-import string
 import sys
 import textwrap
 import threading
 import zlib
 
 from typing import (
-    cast, Any, Callable, Collection, Mapping,
-    Sequence,
+    cast, Any, Callable, Collection, Iterable, Iterator, Mapping,
+    Sequence, TypeVar,
 )
 
 from coverage.debug import NoDebugging, auto_repr
 from coverage.exceptions import CoverageException, DataError
 from coverage.misc import file_be_gone, isolate_module
-from coverage.numbits import numbits_to_nums, numbits_union, nums_to_numbits
-from coverage.sqlitedb import SqliteDb
+from coverage.numbits import numbits_to_nums, nums_to_numbits
+from coverage.sqlitedb import SQLITE_MAX_PARAMS, SqliteDb
 from coverage.types import AnyCallable, FilePath, TArc, TDebugCtl, TLineNo, TWarnFn
 from coverage.version import __version__
 
@@ -111,6 +111,43 @@ CREATE TABLE tracer (
 );
 """
 
+# Statements used in more than one place, or many times while measuring. The
+# sqlite3 module keeps prepared statements in a per-connection cache keyed by
+# the SQL text, so using the same strings lets them be reused.
+SQL_INSERT_FILE = "insert or ignore into file (path) values (?)"
+SQL_INSERT_CONTEXT = "insert or ignore into context (context) values (?)"
+SQL_SELECT_CONTEXT_ID = "select id from context where context = ?"
+SQL_UPSERT_LINE_BITS = (
+    "insert into line_bits (file_id, context_id, numbits) values (?, ?, ?) " +
+    "on conflict (file_id, context_id) do update " +
+    "set numbits = numbits_union(numbits, excluded.numbits)"
+)
+# Upserts need SQLite 3.24.  Older versions make sure the row exists, then
+# merge into it.
+SQLITE_HAS_UPSERT = sqlite3.sqlite_version_info >= (3, 24, 0)
+SQL_INSERT_EMPTY_LINE_BITS = (
+    "insert or ignore into line_bits (file_id, context_id, numbits) values (?, ?, x'')"
+)
+SQL_MERGE_LINE_BITS = (
+    "update line_bits set numbits = numbits_union(numbits, ?) " +
+    "where file_id = ? and context_id = ?"
+)
+# Used with SqliteDb.insert_many_void, which adds the VALUES clause.
+SQL_INSERT_ARC = "insert or ignore into arc (file_id, context_id, fromno, tono)"
+SQL_INSERT_TRACER = "insert or ignore into tracer (file_id, tracer)"
+
+# How many rows update() copies from another database in one executemany.
+UPDATE_BATCH_ROWS = 10_000
+
+T = TypeVar("T")
+
+def _chunks(items: Iterable[T], size: int) -> Iterator[list[T]]:
+    """Yield successive lists of at most `size` items from `items`."""
+    it = iter(items)
+    while chunk := list(itertools.islice(it, size)):
+        yield chunk
+
+
 def _locked(method: AnyCallable) -> AnyCallable:
     """A decorator for methods that should hold self._lock."""
     @functools.wraps(method)
@@ -240,6 +277,10 @@ class CoverageData:
         self._choose_filename()
         # Maps filenames to row ids.
         self._file_map: dict[str, int] = {}
+        # Maps context names to row ids.
+        self._context_map: dict[str, int] = {}
+        # The key-value pairs from the meta table.
+        self._meta: dict[str, str] = {}
         # Maps thread ids to SqliteDb objects.
         self._dbs: dict[int, SqliteDb] = {}
         self._pid = os.getpid()
@@ -253,7 +294,6 @@ class CoverageData:
         self._has_arcs = False
 
         self._current_context: str | None = None
-        self._current_context_id: int | None = None
         self._query_context_ids: list[int] | None = None
 
     __repr__ = auto_repr
@@ -275,8 +315,9 @@ class CoverageData:
                 db.close()
             self._dbs = {}
         self._file_map = {}
+        self._context_map = {}
+        self._meta = {}
         self._have_used = False
-        self._current_context_id = None
 
     def _open_db(self) -> None:
         """Open an existing db file, and read its metadata."""
@@ -309,22 +350,33 @@ class CoverageData:
                         ),
                     )
 
-            row = db.execute_one("select value from meta where key = 'has_arcs'")
-            if row is not None:
-                self._has_arcs = bool(int(row[0]))
+            with db.execute("select key, value from meta") as cur:
+                for key, value in cur:
+                    self._meta[key] = value
+            if "has_arcs" in self._meta:
+                self._has_arcs = bool(int(self._meta["has_arcs"]))
                 self._has_lines = not self._has_arcs
 
             with db.execute("select id, path from file") as cur:
                 for file_id, path in cur:
                     self._file_map[path] = file_id
 
+            with db.execute("select id, context from context") as cur:
+                for context_id, context in cur:
+                    self._context_map[context] = context_id
+
     def _init_db(self, db: SqliteDb) -> None:
         """Write the initial contents of the database."""
         if self._debug.should("dataio"):
             self._debug.write(f"Initing data file {self._filename!r}")
         db.executescript(SCHEMA)
         db.execute_void("insert into coverage_schema (version) values (?)", (SCHEMA_VERSION,))
+        meta_data = self._run_meta_data()
+        db.executemany_void("insert or ignore into meta (key, value) values (?, ?)", meta_data)
+        self._meta.update(meta_data)
 
+    def _run_meta_data(self) -> list[tuple[str, str]]:
+        """The meta rows describing this run, written into new data files."""
         # When writing metadata, avoid information that will needlessly change
         # the hash of the data file, unless we're debugging processes.
         meta_data = [
@@ -335,21 +387,40 @@ class CoverageData:
                 ("sys_argv", str(getattr(sys, "argv", None))),
                 ("when", datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
             ])
-        db.executemany_void("insert or ignore into meta (key, value) values (?, ?)", meta_data)
+        return meta_data
 
     def _connect(self) -> SqliteDb:
         """Get the SqliteDb object to use."""
-        if threading.get_ident() not in self._dbs:
+        db = self._dbs.get(threading.get_ident())
+        if db is None:
             self._open_db()
-        return self._dbs[threading.get_ident()]
+            db = self._dbs[threading.get_ident()]
+        return db
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[SqliteDb]:
+        """Get the SqliteDb object to use for a batch of writes.
+
+        The writes are done in one transaction, committed when the outermost
+        ``with`` on the SqliteDb ends.  The transaction is IMMEDIATE, so that
+        it takes the write lock up front instead of upgrading a read lock
+        part-way through.
+        """
+        with self._connect() as con:
+            assert con.con is not None
+            con.con.isolation_level = "IMMEDIATE"
+            yield con
 
     def __bool__(self) -> bool:
+        if self._file_map:
+            # We've already seen files in the database.
+            return True
         if (threading.get_ident() not in self._dbs and not os.path.exists(self._filename)):
             return False
         try:
             with self._connect() as con:
                 with con.execute("select * from file limit 1") as cur:
-                    return bool(list(cur))
+                    return cur.fetchone() is not None
         except CoverageException:
             return False
 
@@ -373,8 +444,16 @@ class CoverageData:
         if self._debug.should("dataio"):
             self._debug.write(f"Dumping data from data file {self._filename!r}")
         with self._connect() as con:
-            script = con.dump()
-            return b"z" + zlib.compress(script.encode("utf-8"))
+            # Level 1 compresses about three times as fast as the default
+            # level, and the result is only a few percent larger.  Compress
+            # the statements as they come, so the whole script is never in
+            # memory at once.
+            compressor = zlib.compressobj(level=1)
+            data = bytearray(b"z")
+            for statement in con.iterdump():
+                data += compressor.compress(statement.encode("utf-8") + b"\n")
+            data += compressor.flush()
+            return bytes(data)
 
     def loads(self, data: bytes) -> None:
         """Deserialize data from :meth:`dumps`.
@@ -404,33 +483,40 @@ class CoverageData:
         self._read_db()
         self._have_used = True
 
-    def _file_id(self, filename: str, add: bool = False) -> int | None:
-        """Get the file id for `filename`.
+    def _file_id(self, filename: str) -> int | None:
+        """Get the file id for `filename`, or None if it isn't in the database."""
+        return self._file_map.get(filename)
 
-        If filename is not in the database yet, add it if `add` is True.
-        If `add` is not True, return None.
+    def _ensure_file_ids(self, con: SqliteDb, filenames: Iterable[str]) -> None:
+        """Make sure all of `filenames` have ids in the database and in _file_map.
+
+        Unknown file names are added in one batch, and their ids read back in
+        as few queries as possible.
         """
-        if filename not in self._file_map:
-            if add:
-                with self._connect() as con:
-                    self._file_map[filename] = con.execute_for_rowid(
-                        "insert or replace into file (path) values (?)",
-                        (filename,),
-                    )
-        return self._file_map.get(filename)
+        new_filenames = list(dict.fromkeys(f for f in filenames if f not in self._file_map))
+        if not new_filenames:
+            return
+        con.executemany_void(SQL_INSERT_FILE, ((filename,) for filename in new_filenames))
+        for chunk in _chunks(new_filenames, SQLITE_MAX_PARAMS):
+            qmarks = ", ".join("?" * len(chunk))
+            with con.execute(f"select id, path from file where path in ({qmarks})", chunk) as cur:
+                for file_id, path in cur:
+                    self._file_map[path] = file_id
 
     def _context_id(self, context: str) -> int | None:
         """Get the id for a context."""
         assert context is not None
         self._start_using()
+        if context in self._context_map:
+            return self._context_map[context]
         with self._connect() as con:
-            row = con.execute_one("select id from context where context = ?", (context,))
+            row = con.execute_one(SQL_SELECT_CONTEXT_ID, (context,))
             if row is not None:
-                return cast(int, row[0])
+                self._context_map[context] = cast(int, row[0])
+                return self._context_map[context]
             else:
                 return None
 
-    @_locked
     def set_context(self, context: str | None) -> None:
         """Set the current context for future :meth:`add_lines` etc.
 
@@ -442,21 +528,22 @@ class CoverageData:
         """
         if self._debug.should("dataop"):
             self._debug.write(f"Setting coverage context: {context!r}")
+        # This doesn't need the lock: it's a single assignment, and the
+        # methods that write data read the context only once.
         self._current_context = context
-        self._current_context_id = None
 
-    def _set_context_id(self) -> None:
-        """Use the _current_context to set _current_context_id."""
+    def _get_current_context_id(self) -> int:
+        """Get the id of _current_context, adding it to the db if needed."""
         context = self._current_context or ""
         context_id = self._context_id(context)
-        if context_id is not None:
-            self._current_context_id = context_id
-        else:
+        if context_id is None:
             with self._connect() as con:
-                self._current_context_id = con.execute_for_rowid(
-                    "insert into context (context) values (?)",
-                    (context,),
-                )
+                # Another thread or process might have added the context since
+                # we looked, so don't fail if it's already there.
+                con.execute_void(SQL_INSERT_CONTEXT, (context,))
+            context_id = self._context_id(context)
+            assert context_id is not None
+        return context_id
 
     def base_filename(self) -> str:
         """The base filename for storing data.
@@ -494,22 +581,35 @@ class CoverageData:
         self._choose_lines_or_arcs(lines=True)
         if not line_data:
             return
-        with self._connect() as con:
-            self._set_context_id()
-            for filename, linenos in line_data.items():
-                line_bits = nums_to_numbits(linenos)
-                file_id = self._file_id(filename, add=True)
-                query = "select numbits from line_bits where file_id = ? and context_id = ?"
-                with con.execute(query, (file_id, self._current_context_id)) as cur:
-                    existing = list(cur)
-                if existing:
-                    line_bits = numbits_union(line_bits, existing[0][0])
+        with self._transaction() as con:
+            context_id = self._get_current_context_id()
+            self._ensure_file_ids(con, line_data)
+            self._merge_line_bits(
+                con,
+                [
+                    (
+                        self._file_map[filename],
+                        context_id,
+                        nums_to_numbits(linenos),
+                    )
+                    for filename, linenos in line_data.items()
+                ],
+            )
 
-                con.execute_void(
-                    "insert or replace into line_bits " +
-                    " (file_id, context_id, numbits) values (?, ?, ?)",
-                    (file_id, self._current_context_id, line_bits),
-                )
+    def _merge_line_bits(self, con: SqliteDb, rows: list[tuple[int, int, bytes]]) -> None:
+        """Write line_bits rows, merging them with any numbits already there.
+
+        `rows` are (file_id, context_id, numbits) tuples.
+
+        """
+        if SQLITE_HAS_UPSERT:
+            con.executemany_void(SQL_UPSERT_LINE_BITS, rows)
+        else:
+            con.executemany_void(SQL_INSERT_EMPTY_LINE_BITS, [row[:2] for row in rows])
+            con.executemany_void(
+                SQL_MERGE_LINE_BITS,
+                [(numbits, file_id, context_id) for file_id, context_id, numbits in rows],
+            )
 
     @_locked
     def add_arcs(self, arc_data: Mapping[str, Collection[TArc]]) -> None:
@@ -532,18 +632,24 @@ class CoverageData:
         self._choose_lines_or_arcs(arcs=True)
         if not arc_data:
             return
-        with self._connect() as con:
-            self._set_context_id()
-            for filename, arcs in arc_data.items():
-                if not arcs:
-                    continue
-                file_id = self._file_id(filename, add=True)
-                data = [(file_id, self._current_context_id, fromno, tono) for fromno, tono in arcs]
-                con.executemany_void(
-                    "insert or ignore into arc " +
-                    "(file_id, context_id, fromno, tono) values (?, ?, ?, ?)",
-                    data,
-                )
+        with self._transaction() as con:
+            context_id = self._get_current_context_id()
+            self._ensure_file_ids(con, (filename for filename, arcs in arc_data.items() if arcs))
+            # Look up each file's id once, not once per arc.
+            file_arcs = [
+                (self._file_map[filename], arcs)
+                for filename, arcs in arc_data.items() if arcs
+            ]
+            # Arcs inserted in the order of the arc table's unique index go
+            # into the index much faster than in the order a set gives them.
+            con.insert_many_void(
+                SQL_INSERT_ARC,
+                (
+                    (file_id, context_id, fromno, tono)
+                    for file_id, arcs in file_arcs
+                    for fromno, tono in sorted(arcs)
+                ),
+            )
 
     def _choose_lines_or_arcs(self, lines: bool = False, arcs: bool = False) -> None:
         """Force the data file to choose between lines and arcs."""
@@ -560,10 +666,11 @@ class CoverageData:
         if not self._has_arcs and not self._has_lines:
             self._has_lines = lines
             self._has_arcs = arcs
+            self._meta["has_arcs"] = str(int(arcs))
             with self._connect() as con:
                 con.execute_void(
                     "insert or ignore into meta (key, value) values (?, ?)",
-                    ("has_arcs", str(int(arcs))),
+                    ("has_arcs", self._meta["has_arcs"]),
                 )
 
     @_locked
@@ -578,10 +685,20 @@ class CoverageData:
         if not file_tracers:
             return
         self._start_using()
-        with self._connect() as con:
-            for filename, plugin_name in file_tracers.items():
-                file_id = self._file_id(filename, add=True)
-                existing_plugin = self.file_tracer(filename)
+        with self._transaction() as con:
+            self._ensure_file_ids(con, file_tracers)
+            file_ids = [self._file_map[filename] for filename in file_tracers]
+            existing_tracers: dict[int, str] = {}
+            for chunk in _chunks(file_ids, SQLITE_MAX_PARAMS):
+                qmarks = ", ".join("?" * len(chunk))
+                query = f"select file_id, tracer from tracer where file_id in ({qmarks})"
+                with con.execute(query, chunk) as cur:
+                    existing_tracers.update(cur)
+
+            new_tracers = []
+            set_tracers = []
+            for (filename, plugin_name), file_id in zip(file_tracers.items(), file_ids):
+                existing_plugin = existing_tracers.get(file_id)
                 if existing_plugin:
                     if existing_plugin != plugin_name:
                         raise DataError(
@@ -590,10 +707,13 @@ class CoverageData:
                             ),
                         )
                 elif plugin_name:
-                    con.execute_void(
-                        "insert into tracer (file_id, tracer) values (?, ?)",
-                        (file_id, plugin_name),
-                    )
+                    if existing_plugin is None:
+                        new_tracers.append((file_id, plugin_name))
+                    else:
+                        # update() stores '' for files without a tracer.
+                        set_tracers.append((plugin_name, file_id))
+            con.insert_many_void(SQL_INSERT_TRACER, new_tracers)
+            con.executemany_void("update tracer set tracer = ? where file_id = ?", set_tracers)
 
     def touch_file(self, filename: str, plugin_name: str = "") -> None:
         """Ensure that `filename` appears in the data, empty if needed.
@@ -612,15 +732,14 @@ class CoverageData:
         if self._debug.should("dataop"):
             self._debug.write(f"Touching {filenames!r}")
         self._start_using()
-        with self._connect(): # Use this to get one transaction.
+        with self._transaction() as con:
             if not self._has_arcs and not self._has_lines:
                 raise DataError("Can't touch files in an empty CoverageData")
 
-            for filename in filenames:
-                self._file_id(filename, add=True)
-                if plugin_name:
-                    # Set the tracer for this file
-                    self.add_file_tracers({filename: plugin_name})
+            self._ensure_file_ids(con, filenames)
+            if plugin_name:
+                # Set the tracer for these files
+                self.add_file_tracers(dict.fromkeys(filenames, plugin_name))
 
     def purge_files(self, filenames: Collection[str]) -> None:
         """Purge any existing coverage data for the given `filenames`.
@@ -631,20 +750,19 @@ class CoverageData:
         if self._debug.should("dataop"):
             self._debug.write(f"Purging data for {filenames!r}")
         self._start_using()
-        with self._connect() as con:
+        with self._transaction() as con:
 
             if self._has_lines:
-                sql = "delete from line_bits where file_id=?"
+                table = "line_bits"
             elif self._has_arcs:
-                sql = "delete from arc where file_id=?"
+                table = "arc"
             else:
                 raise DataError("Can't purge files in an empty CoverageData")
 
-            for filename in filenames:
-                file_id = self._file_id(filename, add=False)
-                if file_id is None:
-                    continue
-                con.execute_void(sql, (file_id,))
+            file_ids = [self._file_map[f] for f in filenames if f in self._file_map]
+            for chunk in _chunks(file_ids, SQLITE_MAX_PARAMS):
+                qmarks = ", ".join("?" * len(chunk))
+                con.execute_void(f"delete from {table} where file_id in ({qmarks})", chunk)
 
     def update(
         self,
@@ -672,151 +790,151 @@ class CoverageData:
         # Force the database we're writing to to exist before we start nesting contexts.
         self._start_using()
 
-        # Collector for all arcs, lines and tracers
         other_data.read()
-        with other_data._connect() as con:
-            # Get files data.
-            with con.execute("select path from file") as cur:
-                files = {path: map_path(path) for (path,) in cur}
-
-            # Get contexts data.
-            with con.execute("select context from context") as cur:
-                contexts = [context for (context,) in cur]
-
-            # Get arc data.
-            with con.execute(
-                "select file.path, context.context, arc.fromno, arc.tono " +
-                "from arc " +
-                "inner join file on file.id = arc.file_id " +
-                "inner join context on context.id = arc.context_id",
-            ) as cur:
-                arcs = [
-                    (files[path], context, fromno, tono)
-                    for (path, context, fromno, tono) in cur
-                ]
-
-            # Get line data.
-            with con.execute(
-                "select file.path, context.context, line_bits.numbits " +
-                "from line_bits " +
-                "inner join file on file.id = line_bits.file_id " +
-                "inner join context on context.id = line_bits.context_id",
-            ) as cur:
-                lines: dict[tuple[str, str], bytes] = {}
-                for path, context, numbits in cur:
-                    key = (files[path], context)
-                    if key in lines:
-                        numbits = numbits_union(lines[key], numbits)
-                    lines[key] = numbits
+        with other_data._connect() as other_con:
+            # Get files data, keyed by the other database's file ids.
+            with other_con.execute("select id, path from file") as cur:
+                paths = {file_id: path for file_id, path in cur}
+            files = {file_id: map_path(path) for file_id, path in paths.items()}
+
+            if files and files == paths and self._is_empty():
+                # There's nothing to merge into and nothing to re-map, so
+                # copy the other database wholesale.
+                self._copy_from(other_con)
+                return
+
+            # Get contexts data, keyed by the other database's context ids.
+            with other_con.execute("select id, context from context") as cur:
+                contexts = {context_id: context for context_id, context in cur}
 
             # Get tracer data.
-            with con.execute(
-                "select file.path, tracer " +
-                "from tracer " +
-                "inner join file on file.id = tracer.file_id",
-            ) as cur:
-                tracers = {files[path]: tracer for (path, tracer) in cur}
-
-        with self._connect() as con:
-            assert con.con is not None
-            con.con.isolation_level = "IMMEDIATE"
-
-            # Get all tracers in the DB. Files not in the tracers are assumed
-            # to have an empty string tracer. Since Sqlite does not support
-            # full outer joins, we have to make two queries to fill the
-            # dictionary.
-            with con.execute("select path from file") as cur:
-                this_tracers = {path: "" for path, in cur}
-            with con.execute(
-                "select file.path, tracer from tracer " +
-                "inner join file on file.id = tracer.file_id",
-            ) as cur:
-                this_tracers.update({
-                    map_path(path): tracer
-                    for path, tracer in cur
-                })
-
-            # Create all file and context rows in the DB.
-            con.executemany_void(
-                "insert or ignore into file (path) values (?)",
-                ((file,) for file in files.values()),
-            )
-            with con.execute("select id, path from file") as cur:
-                file_ids = {path: id for id, path in cur}
-            self._file_map.update(file_ids)
-            con.executemany_void(
-                "insert or ignore into context (context) values (?)",
-                ((context,) for context in contexts),
-            )
-            with con.execute("select id, context from context") as cur:
-                context_ids = {context: id for id, context in cur}
-
-            # Prepare tracers and fail, if a conflict is found.
-            # tracer_paths is used to ensure consistency over the tracer data
-            # and tracer_map tracks the tracers to be inserted.
-            tracer_map = {}
-            for path in files.values():
-                this_tracer = this_tracers.get(path)
-                other_tracer = tracers.get(path, "")
-                # If there is no tracer, there is always the None tracer.
-                if this_tracer is not None and this_tracer != other_tracer:
-                    raise DataError(
-                        "Conflicting file tracer name for '{}': {!r} vs {!r}".format(
-                            path, this_tracer, other_tracer,
-                        ),
-                    )
-                tracer_map[path] = other_tracer
-
-            # Prepare arc and line rows to be inserted by converting the file
-            # and context strings with integer ids. Then use the efficient
-            # `executemany()` to insert all rows at once.
-
-            if arcs:
-                self._choose_lines_or_arcs(arcs=True)
-
-                arc_rows = (
-                    (file_ids[file], context_ids[context], fromno, tono)
-                    for file, context, fromno, tono in arcs
-                )
+            with other_con.execute("select file_id, tracer from tracer") as cur:
+                tracers = {files[file_id]: tracer for file_id, tracer in cur}
+
+            with self._transaction() as con:
+                # Get all tracers in the DB. Files not in the tracers are assumed
+                # to have an empty string tracer. Since Sqlite does not support
+                # full outer joins, we have to make two queries to fill the
+                # dictionary.
+                with con.execute("select path from file") as cur:
+                    this_tracers = {path: "" for path, in cur}
+                with con.execute(
+                    "select file.path, tracer from tracer " +
+                    "inner join file on file.id = tracer.file_id",
+                ) as cur:
+                    this_tracers.update({
+                        map_path(path): tracer
+                        for path, tracer in cur
+                    })
+
+                # Prepare tracers and fail, if a conflict is found.  This is
+                # done before writing anything: with journal_mode=off, a
+                # rollback can't be relied on to undo earlier writes.
+                # tracer_paths is used to ensure consistency over the tracer data
+                # and tracer_map tracks the tracers to be inserted.
+                tracer_map = {}
+                for path in files.values():
+                    this_tracer = this_tracers.get(path)
+                    other_tracer = tracers.get(path, "")
+                    # If there is no tracer, there is always the None tracer.
+                    if this_tracer is not None and this_tracer != other_tracer:
+                        raise DataError(
+                            "Conflicting file tracer name for '{}': {!r} vs {!r}".format(
+                                path, this_tracer, other_tracer,
+                            ),
+                        )
+                    tracer_map[path] = other_tracer
 
-                # Write the combined data.
+                # Create all file and context rows in the DB.
+                con.executemany_void(SQL_INSERT_FILE, ((file,) for file in files.values()))
+                with con.execute("select id, path from file") as cur:
+                    file_ids = {path: id for id, path in cur}
+                self._file_map.update(file_ids)
                 con.executemany_void(
-                    "insert or ignore into arc " +
-                    "(file_id, context_id, fromno, tono) values (?, ?, ?, ?)",
-                    arc_rows,
+                    SQL_INSERT_CONTEXT,
+                    ((context,) for context in contexts.values()),
                 )
-
-            if lines:
-                self._choose_lines_or_arcs(lines=True)
-
-                for (file, context), numbits in lines.items():
-                    with con.execute(
-                        "select numbits from line_bits where file_id = ? and context_id = ?",
-                        (file_ids[file], context_ids[context]),
-                    ) as cur:
-                        existing = list(cur)
-                    if existing:
-                        lines[(file, context)] = numbits_union(numbits, existing[0][0])
-
-                con.executemany_void(
-                    "insert or replace into line_bits " +
-                    "(file_id, context_id, numbits) values (?, ?, ?)",
-                    [
-                        (file_ids[file], context_ids[context], numbits)
-                        for (file, context), numbits in lines.items()
-                    ],
+                with con.execute("select id, context from context") as cur:
+                    context_ids = {context: id for id, context in cur}
+                self._context_map.update(context_ids)
+
+                # Translate the other database's ids to ours once, so the arc
+                # and line rows can be read without joining to the file and
+                # context tables, and converted with integer-keyed lookups.
+                file_id_map = {
+                    other_id: file_ids[path] for other_id, path in files.items()
+                }
+                context_id_map = {
+                    other_id: context_ids[context] for other_id, context in contexts.items()
+                }
+
+                # The arc and line rows are copied in batches, so that a large
+                # data file doesn't have to be held in memory all at once.
+                # Reading in index order costs nothing, and makes the inserts
+                # mostly sequential too.
+                with other_con.execute(
+                    "select file_id, context_id, fromno, tono from arc " +
+                    "order by file_id, context_id, fromno, tono",
+                ) as cur:
+                    arc_rows = (
+                        (file_id_map[file_id], context_id_map[context_id], fromno, tono)
+                        for file_id, context_id, fromno, tono in cur
+                    )
+                    for arc_chunk in _chunks(arc_rows, UPDATE_BATCH_ROWS):
+                        self._choose_lines_or_arcs(arcs=True)
+                        con.insert_many_void(SQL_INSERT_ARC, arc_chunk)
+
+                with other_con.execute(
+                    "select file_id, context_id, numbits from line_bits",
+                ) as cur:
+                    line_rows = (
+                        (file_id_map[file_id], context_id_map[context_id], numbits)
+                        for file_id, context_id, numbits in cur
+                    )
+                    for line_chunk in _chunks(line_rows, UPDATE_BATCH_ROWS):
+                        self._choose_lines_or_arcs(lines=True)
+                        # Several files can map to the same path, and we might
+                        # already have data for it: SQLite merges the numbits.
+                        self._merge_line_bits(con, line_chunk)
+
+                con.insert_many_void(
+                    SQL_INSERT_TRACER,
+                    ((file_ids[filename], tracer) for filename, tracer in tracer_map.items()),
                 )
 
-            con.executemany_void(
-                "insert or ignore into tracer (file_id, tracer) values (?, ?)",
-                ((file_ids[filename], tracer) for filename, tracer in tracer_map.items()),
-            )
-
         if not self._no_disk:
             # Update all internal cache data.
             self._reset()
             self.read()
 
+    def _is_empty(self) -> bool:
+        """Is our database free of any measurement data?"""
+        if self._has_lines or self._has_arcs:
+            return False
+        with self._connect() as con:
+            row = con.execute_one(
+                "select exists (select 1 from file) or exists (select 1 from context)",
+            )
+            assert row is not None
+            return not row[0]
+
+    def _copy_from(self, other_con: SqliteDb) -> None:
+        """Replace our (empty) database with a copy of the one on `other_con`."""
+        if self._debug.should("dataio"):
+            self._debug.write(f"Copying data from {other_con.filename!r}")
+        with self._connect() as con:
+            assert other_con.con is not None
+            assert con.con is not None
+            other_con.con.backup(con.con)
+            # The copied meta rows describe the run that wrote the other file.
+            # Describe this run instead, as a new data file would.
+            con.execute_void("delete from meta where key in ('version', 'sys_argv', 'when')")
+            con.executemany_void(
+                "insert into meta (key, value) values (?, ?)",
+                self._run_meta_data(),
+            )
+        self._read_db()
+
     def erase(self, parallel: bool = False) -> None:
         """Erase the data in this object.
 
@@ -832,9 +950,18 @@ class CoverageData:
         file_be_gone(self._filename)
         if parallel:
             data_dir, local = os.path.split(self._filename)
-            local_abs_path = os.path.join(os.path.abspath(data_dir), local)
-            pattern = glob.escape(local_abs_path) + ".*"
-            for filename in glob.glob(pattern):
+            # A prefix check on one directory listing is all we need, no need
+            # for glob to match a pattern against every entry.
+            prefix = os.path.normcase(local + ".")
+            try:
+                with os.scandir(os.path.abspath(data_dir)) as entries:
+                    filenames = [
+                        entry.path for entry in entries
+                        if os.path.normcase(entry.name).startswith(prefix)
+                    ]
+            except FileNotFoundError:
+                filenames = []
+            for filename in filenames:
                 if self._debug.should("dataio"):
                     self._debug.write(f"Erasing parallel data file {filename!r}")
                 file_be_gone(filename)
@@ -880,10 +1007,7 @@ class CoverageData:
 
         """
         self._start_using()
-        with self._connect() as con:
-            with con.execute("select distinct(context) from context") as cur:
-                contexts = {row[0] for row in cur}
-        return contexts
+        return set(self._context_map)
 
     def file_tracer(self, filename: str) -> str | None:
         """Get the plugin name of the file tracer for a file.
@@ -894,10 +1018,10 @@ class CoverageData:
 
         """
         self._start_using()
+        file_id = self._file_id(filename)
+        if file_id is None:
+            return None
         with self._connect() as con:
-            file_id = self._file_id(filename)
-            if file_id is None:
-                return None
             row = con.execute_one("select tracer from tracer where file_id = ?", (file_id,))
             if row is not None:
                 return row[0] or ""
@@ -914,10 +1038,8 @@ class CoverageData:
         .. versionadded:: 5.0
 
         """
-        self._start_using()
-        with self._connect() as con:
-            with con.execute("select id from context where context = ?", (context,)) as cur:
-                self._query_context_ids = [row[0] for row in cur.fetchall()]
+        context_id = self._context_id(context)
+        self._query_context_ids = [context_id] if context_id is not None else []
 
     def set_query_contexts(self, contexts: Sequence[str] | None) -> None:
         """Set a number of contexts for subsequent querying.
@@ -933,13 +1055,37 @@ class CoverageData:
         """
         self._start_using()
         if contexts:
+            # Match the contexts in Python: a SQL function would be called
+            # back for every row and pattern.
+            regexes = []
+            for context in contexts:
+                try:
+                    regexes.append(re.compile(context))
+                except re.error as exc:
+                    raise DataError(f"Invalid context pattern {context!r}: {exc}") from exc
             with self._connect() as con:
-                context_clause = " or ".join(["context regexp ?"] * len(contexts))
-                with con.execute("select id from context where " + context_clause, contexts) as cur:
-                    self._query_context_ids = [row[0] for row in cur.fetchall()]
+                with con.execute("select id, context from context") as cur:
+                    self._query_context_ids = [
+                        context_id for context_id, context in cur
+                        if any(regex.search(context) for regex in regexes)
+                    ]
         else:
             self._query_context_ids = None
 
+    def _query_context_clause(self, column: str) -> tuple[str, list[int]]:
+        """Make the SQL condition limiting `column` to the query contexts.
+
+        Returns the text to add to a where clause, and its parameters.
+
+        """
+        ids = self._query_context_ids
+        if ids is None:
+            return "", []
+        elif len(ids) == 1:
+            return f" and {column} = ?", ids
+        else:
+            return f" and {column} in (" + ", ".join("?" * len(ids)) + ")", ids
+
     def lines(self, filename: str) -> list[TLineNo] | None:
         """Get the list of lines executed for a source file.
 
@@ -957,23 +1103,22 @@ class CoverageData:
                 all_lines = itertools.chain.from_iterable(arcs)
                 return list({l for l in all_lines if l > 0})
 
+        file_id = self._file_id(filename)
+        if file_id is None:
+            return None
         with self._connect() as con:
-            file_id = self._file_id(filename)
-            if file_id is None:
-                return None
-            else:
-                query = "select numbits from line_bits where file_id = ?"
-                data = [file_id]
-                if self._query_context_ids is not None:
-                    ids_array = ", ".join("?" * len(self._query_context_ids))
-                    query += " and context_id in (" + ids_array + ")"
-                    data += self._query_context_ids
-                with con.execute(query, data) as cur:
-                    bitmaps = list(cur)
-                nums = set()
-                for row in bitmaps:
-                    nums.update(numbits_to_nums(row[0]))
-                return list(nums)
+            query = "select numbits from line_bits where file_id = ?"
+            data = [file_id]
+            context_clause, context_data = self._query_context_clause("context_id")
+            query += context_clause
+            data += context_data
+            # Or the numbits of all the contexts together as ints, then
+            # decode the union once, instead of decoding every row.
+            bits = 0
+            with con.execute(query, data) as cur:
+                for row in cur:
+                    bits |= int.from_bytes(row[0], "little")
+            return numbits_to_nums(bits.to_bytes((bits.bit_length() + 7) // 8, "little"))
 
     def arcs(self, filename: str) -> list[TArc] | None:
         """Get the list of arcs executed for a file.
@@ -993,19 +1138,17 @@ class CoverageData:
 
         """
         self._start_using()
+        file_id = self._file_id(filename)
+        if file_id is None:
+            return None
         with self._connect() as con:
-            file_id = self._file_id(filename)
-            if file_id is None:
-                return None
-            else:
-                query = "select distinct fromno, tono from arc where file_id = ?"
-                data = [file_id]
-                if self._query_context_ids is not None:
-                    ids_array = ", ".join("?" * len(self._query_context_ids))
-                    query += " and context_id in (" + ids_array + ")"
-                    data += self._query_context_ids
-                with con.execute(query, data) as cur:
-                    return list(cur)
+            query = "select distinct fromno, tono from arc where file_id = ?"
+            data = [file_id]
+            context_clause, context_data = self._query_context_clause("context_id")
+            query += context_clause
+            data += context_data
+            with con.execute(query, data) as cur:
+                return list(cur)
 
     def contexts_by_lineno(self, filename: str) -> dict[TLineNo, list[str]]:
         """Get the contexts for each line in a file.
@@ -1017,29 +1160,31 @@ class CoverageData:
 
         """
         self._start_using()
-        with self._connect() as con:
-            file_id = self._file_id(filename)
-            if file_id is None:
-                return {}
+        file_id = self._file_id(filename)
+        if file_id is None:
+            return {}
 
+        with self._connect() as con:
             lineno_contexts_map = collections.defaultdict(set)
             if self.has_arcs():
+                # Let SQLite find the distinct (line, context) pairs from the
+                # arc index, so each one comes back to Python only once.
+                where = "file_id = ?"
+                data = [file_id]
+                context_clause, context_data = self._query_context_clause("context_id")
+                where += context_clause
+                data += context_data
                 query = (
-                    "select arc.fromno, arc.tono, context.context " +
-                    "from arc, context " +
-                    "where arc.file_id = ? and arc.context_id = context.id"
+                    "select a.lineno, context.context from (" +
+                    f"select fromno as lineno, context_id from arc where {where} and fromno > 0 " +
+                    "union " +
+                    f"select tono, context_id from arc where {where} and tono > 0" +
+                    ") a, context " +
+                    "where a.context_id = context.id"
                 )
-                data = [file_id]
-                if self._query_context_ids is not None:
-                    ids_array = ", ".join("?" * len(self._query_context_ids))
-                    query += " and arc.context_id in (" + ids_array + ")"
-                    data += self._query_context_ids
-                with con.execute(query, data) as cur:
-                    for fromno, tono, context in cur:
-                        if fromno > 0:
-                            lineno_contexts_map[fromno].add(context)
-                        if tono > 0:
-                            lineno_contexts_map[tono].add(context)
+                with con.execute(query, data + data) as cur:
+                    for lineno, context in cur:
+                        lineno_contexts_map[lineno].add(context)
             else:
                 query = (
                     "select l.numbits, c.context from line_bits l, context c " +
@@ -1047,10 +1192,9 @@ class CoverageData:
                     "and file_id = ?"
                 )
                 data = [file_id]
-                if self._query_context_ids is not None:
-                    ids_array = ", ".join("?" * len(self._query_context_ids))
-                    query += " and l.context_id in (" + ids_array + ")"
-                    data += self._query_context_ids
+                context_clause, context_data = self._query_context_clause("l.context_id")
+                query += context_clause
+                data += context_data
                 with con.execute(query, data) as cur:
                     for numbits, context in cur:
                         for lineno in numbits_to_nums(numbits):
@@ -1094,9 +1238,7 @@ def filename_suffix(suffix: str | bool | None) -> str | None:
         # plenty of distinguishing information.  We do this here in
         # `save()` at the last minute so that the pid will be correct even
         # if the process forks.
-        die = random.Random(os.urandom(8))
-        letters = string.ascii_uppercase + string.ascii_lowercase
-        rolls = "".join(die.choice(letters) for _ in range(6))
+        rolls = base64.b32encode(os.urandom(5)).decode("ascii")[:6]
         suffix = f"{socket.gethostname()}.{os.getpid()}.X{rolls}x"
     elif suffix is False:
         suffix = None
@@ -6,15 +6,18 @@
 from __future__ import annotations
 
 import contextlib
-import re
 import sqlite3
 
-from typing import cast, Any, Iterable, Iterator, Tuple
+from typing import cast, Any, Iterable, Iterator, Sequence, Tuple
 
 from coverage.debug import auto_repr, clipped_repr, exc_one_line
 from coverage.exceptions import DataError
+from coverage.numbits import numbits_union
 from coverage.types import TDebugCtl
 
+# SQLite before 3.32 allows at most 999 parameters in one statement.
+SQLITE_MAX_PARAMS = 999
+
 
 class SqliteDb:
     """A simple abstraction over a SQLite database.
@@ -56,7 +59,9 @@ class SqliteDb:
         if self.debug.should("sql"):
             self.debug.write(f"Connected to {self.filename!r} as {self.con!r}")
 
-        self.con.create_function("REGEXP", 2, lambda txt, pat: re.search(txt, pat) is not None)
+        # Let SQLite merge numbits itself, so upserts don't need a round trip
+        # through Python to read the existing value.
+        self.con.create_function("numbits_union", 2, numbits_union, deterministic=True)
 
         # Turning off journal_mode can speed up writing. It can't always be
         # disabled, so we have to be prepared for *-journal files elsewhere.
@@ -75,6 +80,10 @@ class SqliteDb:
         # to keep things going.
         self.execute_void("pragma synchronous=off", fail_ok=True)
 
+        # Keep temporary tables and indexes (used for DISTINCT, GROUP BY and
+        # sorting) in memory rather than in temporary files.
+        self.execute_void("pragma temp_store=memory", fail_ok=True)
+
     def close(self) -> None:
         """If needed, close the connection."""
         if self.con is not None and self.filename != ":memory:":
@@ -165,15 +174,6 @@ class SqliteDb:
             if not fail_ok:
                 raise
 
-    def execute_for_rowid(self, sql: str, parameters: Iterable[Any] = ()) -> int:
-        """Like execute, but returns the lastrowid."""
-        with self.execute(sql, parameters) as cur:
-            assert cur.lastrowid is not None
-            rowid: int = cur.lastrowid
-        if self.debug.should("sqldata"):
-            self.debug.write(f"Row id result: {rowid!r}")
-        return rowid
-
     def execute_one(self, sql: str, parameters: Iterable[Any] = ()) -> tuple[Any, ...] | None:
         """Execute a statement and return the one row that results.
 
@@ -215,6 +215,45 @@ class SqliteDb:
         if data:
             self._executemany(sql, data).close()
 
+    def insert_many_void(self, sql: str, data: Iterable[Sequence[Any]]) -> None:
+        """Insert the rows in `data`, many rows per statement.
+
+        `sql` is an INSERT statement without its VALUES clause.  The rows are
+        inserted in batches with multi-row ``values (?, ?), (?, ?), ...``
+        statements, which SQLite runs faster than one statement per row.
+
+        """
+        rows: list[Sequence[Any]] = []
+        nparams = 0
+        for row in data:
+            if nparams + len(row) > SQLITE_MAX_PARAMS:
+                self._insert_rows(sql, rows)
+                rows, nparams = [], 0
+            rows.append(row)
+            nparams += len(row)
+        if rows:
+            self._insert_rows(sql, rows)
+
+    def _insert_rows(self, sql: str, rows: list[Sequence[Any]]) -> None:
+        """Insert `rows` with one statement, for :meth:`insert_many_void`."""
+        if self.debug.should("sql"):
+            final = ":" if self.debug.should("sqldata") else ""
+            self.debug.write(f"Executing {sql!r} with {len(rows)} rows{final}")
+            if self.debug.should("sqldata"):
+                for i, row in enumerate(rows):
+                    self.debug.write(f"{i:4d}: {row!r}")
+        placeholders = "(" + ", ".join("?" * len(rows[0])) + ")"
+        sql += " values " + ", ".join([placeholders] * len(rows))
+        params = [value for row in rows for value in row]
+        assert self.con is not None
+        try:
+            self.con.execute(sql, params).close()
+        except Exception:
+            # In some cases, an error might happen that isn't really an
+            # error.  Try again immediately.
+            # https://github.com/nedbat/coveragepy/issues/1010
+            self.con.execute(sql, params).close()
+
     def executescript(self, script: str) -> None:
         """Same as :meth:`python:sqlite3.Connection.executescript`."""
         if self.debug.should("sql"):
@@ -224,7 +263,7 @@ class SqliteDb:
         assert self.con is not None
         self.con.executescript(script).close()
 
-    def dump(self) -> str:
-        """Return a multi-line string, the SQL dump of the database."""
+    def iterdump(self) -> Iterator[str]:
+        """Produce the SQL dump of the database, one statement at a time."""
         assert self.con is not None
-        return "\n".join(self.con.iterdump())
+        return self.con.iterdump()
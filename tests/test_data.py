@@ -23,7 +23,9 @@ from coverage.data import CoverageData, combine_parallel_data
 from coverage.data import add_data_to_hash, line_counts
 from coverage.exceptions import DataError, NoDataError
 from coverage.files import PathAliases, canonical_filename
+from coverage.sqldata import SCHEMA
 from coverage.types import FilePathClasses, FilePathType, TArc, TLineNo
+from coverage.version import __version__
 
 from tests.coveragetest import CoverageTest
 from tests.helpers import DebugControlString, assert_count_equal
@@ -130,6 +132,15 @@ def dicts_from_sets(file_data: dict[str, set[TData]]) -> dict[str, dict[TData, N
     return {k: dict.fromkeys(v) for k, v in file_data.items()}
 
 
+def query_plan(sql: str) -> list[str]:
+    """Get the EXPLAIN QUERY PLAN details for `sql` on an empty data file."""
+    con = sqlite3.connect(":memory:")
+    con.executescript(SCHEMA)
+    plan = [row[-1] for row in con.execute("explain query plan " + sql)]
+    con.close()
+    return plan
+
+
 class CoverageDataTest(CoverageTest):
     """Test cases for CoverageData."""
 
@@ -190,6 +201,16 @@ class CoverageDataTest(CoverageTest):
         assert_line_counts(covdata, SUMMARY_3_4)
         assert_measured_files(covdata, MEASURED_FILES_3_4)
 
+    def test_adding_many_files(self) -> None:
+        # More files than fit in one SQL statement's parameters.
+        covdata = DebugCoverageData()
+        lines = {f"file{i}.py": {i + 1} for i in range(2500)}
+        covdata.add_lines(lines)
+        covdata.add_lines({"file7.py": {100}, "new.py": {1}})
+        assert len(covdata.measured_files()) == 2501
+        assert sorted(covdata.lines("file7.py") or ()) == [8, 100]
+        assert covdata.lines("file2499.py") == [2500]
+
     def test_ok_to_add_empty_arcs(self) -> None:
         covdata = DebugCoverageData()
         covdata.add_arcs(ARCS_3)
@@ -235,6 +256,14 @@ class CoverageDataTest(CoverageTest):
         covdata.set_query_contexts(['other'])
         assert covdata.lines('a.py') == []
 
+    def test_set_query_contexts_bad_pattern(self) -> None:
+        covdata = DebugCoverageData()
+        covdata.set_context('test_a')
+        covdata.add_lines(LINES_1)
+        msg = r"Invalid context pattern '\(': missing \), unterminated subpattern"
+        with pytest.raises(DataError, match=msg):
+            covdata.set_query_contexts(['test', '('])
+
     def test_no_lines_vs_unmeasured_file(self) -> None:
         covdata = DebugCoverageData()
         covdata.add_lines(LINES_1)
@@ -252,6 +281,18 @@ class CoverageDataTest(CoverageTest):
         covdata.set_query_contexts(['other'])
         assert covdata.lines('a.py') == []
 
+    def test_returning_to_a_context(self) -> None:
+        covdata = DebugCoverageData()
+        covdata.set_context('test_a')
+        covdata.add_lines({'a.py': {1}})
+        covdata.set_context('test_b')
+        covdata.add_lines({'a.py': {2}})
+        covdata.set_context('test_a')
+        covdata.add_lines({'a.py': {3}})
+        assert covdata.measured_contexts() == {'test_a', 'test_b'}
+        expected = {1: ['test_a'], 2: ['test_b'], 3: ['test_a']}
+        assert covdata.contexts_by_lineno('a.py') == expected
+
     def test_contexts_by_lineno_with_lines(self) -> None:
         covdata = DebugCoverageData()
         covdata.set_context('test_a')
@@ -318,6 +359,15 @@ class CoverageDataTest(CoverageTest):
         covdata.set_query_context("test_1")
         assert covdata.contexts_by_lineno("a.py") == dict.fromkeys([1,2], ["test_1"])
 
+    def test_set_query_context_not_there(self) -> None:
+        covdata = DebugCoverageData()
+        covdata.set_context("test_1")
+        covdata.add_lines(LINES_1)
+        covdata.set_query_context("test_2")
+        assert covdata.lines("a.py") == []
+        covdata.set_query_context("test_1")
+        assert sorted(covdata.lines("a.py") or []) == [1, 2]
+
     def test_context_by_lineno_with_query_contexts_with_arcs(self) -> None:
         covdata = DebugCoverageData()
         covdata.set_context("test_1")
@@ -327,6 +377,18 @@ class CoverageDataTest(CoverageTest):
         covdata.set_query_context("test_1")
         assert covdata.contexts_by_lineno("x.py") == dict.fromkeys([1,2,3], ["test_1"])
 
+    def test_unmeasured_file_doesnt_connect(self) -> None:
+        debug = DebugControlString(options=["sql"])
+        covdata = CoverageData(suffix=True, debug=debug)
+        covdata.add_lines(LINES_1)
+        covdata.read()
+        start = len(debug.get_output())
+        assert covdata.lines("xyzzy.py") is None
+        assert covdata.arcs("xyzzy.py") is None
+        assert covdata.contexts_by_lineno("xyzzy.py") == {}
+        assert covdata.file_tracer("xyzzy.py") is None
+        assert "Connecting" not in debug.get_output()[start:]
+
     def test_file_tracer_name(self) -> None:
         covdata = DebugCoverageData()
         covdata.add_lines({
@@ -384,6 +446,90 @@ class CoverageDataTest(CoverageTest):
         assert_line_counts(covdata3, SUMMARY_1_2)
         assert_measured_files(covdata3, MEASURED_FILES_1_2)
 
+    @pytest.mark.parametrize("has_upsert", [True, False])
+    def test_adding_lines_twice(self, has_upsert: bool) -> None:
+        with mock.patch("coverage.sqldata.SQLITE_HAS_UPSERT", has_upsert):
+            covdata = DebugCoverageData()
+            covdata.add_lines({"a.py": {1, 2}})
+            covdata.add_lines({"a.py": {2, 30}, "b.py": {4}})
+            assert sorted(covdata.lines("a.py") or []) == [1, 2, 30]
+            assert covdata.lines("b.py") == [4]
+
+    @pytest.mark.parametrize("has_upsert", [True, False])
+    def test_update_lines_with_map_path(self, has_upsert: bool) -> None:
+        # Without upserts (SQLite before 3.24), lines are merged differently.
+        with mock.patch("coverage.sqldata.SQLITE_HAS_UPSERT", has_upsert):
+            covdata1 = DebugCoverageData(suffix='1')
+            covdata1.add_lines({
+                '/src/a.py': {1, 2},
+                '/other/a.py': {2, 3},
+                '/src/b.py': {4},
+            })
+
+            covdata2 = DebugCoverageData(suffix='2')
+            covdata2.add_lines({'a.py': {7}})
+            covdata2.update(covdata1, map_path=os.path.basename)
+
+            assert_line_counts(covdata2, {'a.py': 4, 'b.py': 1})
+            assert_measured_files(covdata2, ['a.py', 'b.py'])
+
+    @pytest.mark.parametrize("has_upsert", [True, False])
+    def test_update_lines_without_reading_back(self, has_upsert: bool) -> None:
+        # Merging line data happens in SQLite: no numbits are read from the
+        # database being updated.
+        with mock.patch("coverage.sqldata.SQLITE_HAS_UPSERT", has_upsert):
+            covdata1 = DebugCoverageData(suffix='1')
+            covdata1.add_lines(LINES_1)
+
+            debug = DebugControlString(options=["sql"])
+            covdata2 = CoverageData(suffix='2', debug=debug)
+            covdata2.add_lines(LINES_2)
+            covdata2.update(covdata1)
+
+            sql = debug.get_output()
+            assert "select numbits" not in sql
+            assert sql.count("on conflict (file_id, context_id) do update") == (2 if has_upsert else 0)
+            assert_line_counts(covdata2, SUMMARY_1_2)
+
+    @pytest.mark.parametrize("no_disk", [False, True])
+    def test_update_into_empty_data_copies(self, no_disk: bool) -> None:
+        debug1 = DebugControlString(options=["process"])
+        with mock.patch("coverage.sqldata.__version__", "0.1"):
+            covdata1 = CoverageData(suffix='1', no_disk=no_disk, debug=debug1)
+            covdata1.set_context('test_a')
+            covdata1.add_lines(LINES_1)
+        covdata1.add_file_tracers({'b.py': 'b.plugin'})
+
+        debug = DebugControlString(options=["dataio"])
+        covdata2 = CoverageData(suffix='2', no_disk=no_disk, debug=debug)
+        covdata2.update(covdata1)
+        assert "Copying data from" in debug.get_output()
+        assert_lines1_data(covdata2)
+        # The metadata describes this run, not the one that wrote covdata1.
+        with covdata2._connect() as con:
+            with con.execute("select key, value from meta") as cur:
+                meta = dict(cur)
+        assert meta == {"has_arcs": "0", "version": __version__}
+        assert covdata2.measured_contexts() == {'test_a'}
+        assert covdata2.file_tracer('b.py') == 'b.plugin'
+
+        # The copy is ordinary data that can be added to.
+        covdata2.set_context('test_b')
+        covdata2.add_lines(LINES_2)
+        assert_line_counts(covdata2, SUMMARY_1_2)
+        assert covdata2.measured_contexts() == {'test_a', 'test_b'}
+
+    def test_update_into_nonempty_data_doesnt_copy(self) -> None:
+        covdata1 = DebugCoverageData(suffix='1')
+        covdata1.add_lines(LINES_1)
+
+        debug = DebugControlString(options=["dataio"])
+        covdata2 = CoverageData(suffix='2', debug=debug)
+        covdata2.add_lines(LINES_2)
+        covdata2.update(covdata1)
+        assert "Copying data from" not in debug.get_output()
+        assert_line_counts(covdata2, SUMMARY_1_2)
+
     def test_update_arcs(self) -> None:
         covdata1 = DebugCoverageData(suffix='1')
         covdata1.add_arcs(ARCS_3)
@@ -398,6 +544,23 @@ class CoverageDataTest(CoverageTest):
         assert_line_counts(covdata3, SUMMARY_3_4)
         assert_measured_files(covdata3, MEASURED_FILES_3_4)
 
+    @mock.patch("coverage.sqldata.UPDATE_BATCH_ROWS", 2)
+    def test_update_in_small_batches(self) -> None:
+        covdata1 = DebugCoverageData(suffix='1')
+        covdata1.add_arcs(ARCS_3)
+        covdata2 = DebugCoverageData(suffix='2')
+        covdata2.add_arcs(ARCS_4)
+        covdata2.update(covdata1)
+        assert_line_counts(covdata2, SUMMARY_3_4)
+        assert_count_equal(covdata2.arcs("y.py"), Y_PY_ARCS_3)
+
+        covdata3 = DebugCoverageData(suffix='3')
+        covdata3.add_lines(LINES_1)
+        covdata4 = DebugCoverageData(suffix='4')
+        covdata4.add_lines(LINES_2)
+        covdata4.update(covdata3)
+        assert_line_counts(covdata4, SUMMARY_1_2)
+
     def test_update_cant_mix_lines_and_arcs(self) -> None:
         covdata1 = DebugCoverageData(suffix='1')
         covdata1.add_lines(LINES_1)
@@ -463,6 +626,35 @@ class CoverageDataTest(CoverageTest):
         with pytest.raises(DataError, match=msg):
             covdata2.update(covdata1)
 
+    def test_update_conflicting_file_tracers_writes_nothing(self) -> None:
+        covdata1 = DebugCoverageData(suffix='1')
+        covdata1.add_lines({"p1.html": [1, 2, 3]})
+        covdata1.add_file_tracers({"p1.html": "html.plugin"})
+
+        covdata2 = DebugCoverageData(suffix='2')
+        covdata2.add_lines({"p1.html": [1, 2, 3], "p2.py": [4, 5]})
+        covdata2.add_file_tracers({"p1.html": "html.other_plugin"})
+
+        with pytest.raises(DataError, match="Conflicting file tracer name"):
+            covdata1.update(covdata2)
+        assert covdata1.measured_files() == {"p1.html"}
+        assert covdata1.lines("p1.html") == [1, 2, 3]
+
+    def test_add_file_tracers_after_update(self) -> None:
+        # update() stores an empty tracer for p.html, which can be filled in.
+        covdata1 = DebugCoverageData(suffix='1')
+        covdata1.add_lines({"p.html": [1, 2, 3]})
+        covdata2 = DebugCoverageData(suffix='2')
+        covdata2.add_lines({"q.py": [4]})
+        covdata2.update(covdata1)
+        assert covdata2.file_tracer("p.html") == ""
+
+        covdata2.add_file_tracers({"p.html": "html.plugin"})
+        assert covdata2.file_tracer("p.html") == "html.plugin"
+        covdata3 = DebugCoverageData(suffix='2')
+        covdata3.read()
+        assert covdata3.file_tracer("p.html") == "html.plugin"
+
     def test_update_file_tracer_vs_no_file_tracer(self) -> None:
         covdata1 = DebugCoverageData(suffix="1")
         covdata1.add_lines({"p1.html": [1, 2, 3]})
@@ -593,6 +785,55 @@ class CoverageDataTest(CoverageTest):
         assert_lines1_data(covdata)
         assert not exceptions
 
+    def test_thread_stress_with_arcs(self) -> None:
+        covdata = DebugCoverageData()
+        exceptions = []
+
+        def thread_main() -> None:
+            """Every thread will try to add the same data."""
+            try:
+                covdata.add_arcs(ARCS_3)
+            except Exception as ex:         # pragma: only failure
+                exceptions.append(ex)
+
+        threads = [threading.Thread(target=thread_main) for _ in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert_arcs3_data(covdata)
+        assert not exceptions
+
+    def test_thread_stress_with_contexts(self) -> None:
+        covdata = DebugCoverageData()
+        exceptions = []
+
+        def thread_main(n: int) -> None:
+            """Every thread switches contexts while adding its own data."""
+            try:
+                for lineno in range(1, 21):
+                    covdata.set_context(f"ctx{n}")
+                    covdata.add_lines({f"f{n}.py": {lineno}})
+            except Exception as ex:         # pragma: only failure
+                exceptions.append(ex)
+
+        threads = [threading.Thread(target=thread_main, args=(n,)) for n in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert not exceptions
+        contexts = {f"ctx{n}" for n in range(10)}
+        assert covdata.measured_contexts() <= contexts
+        for n in range(10):
+            # Contexts are global, so a line might be recorded with another
+            # thread's context, but every line has a real context.
+            by_lineno = covdata.contexts_by_lineno(f"f{n}.py")
+            assert sorted(by_lineno) == list(range(1, 21))
+            assert all(set(ctxs) <= contexts for ctxs in by_lineno.values())
+
     def test_purge_files_lines(self) -> None:
         covdata = DebugCoverageData()
         covdata.add_lines(LINES_1)
@@ -622,6 +863,32 @@ class CoverageDataTest(CoverageTest):
         with pytest.raises(DataError, match=msg):
             covdata.purge_files(["abc.py"])
 
+    @pytest.mark.parametrize("sql", [
+        "delete from line_bits where file_id = 1",
+        "delete from arc where file_id = 1",
+        "select numbits from line_bits where file_id = 1",
+        "select distinct fromno, tono from arc where file_id = 1",
+        "select tracer from tracer where file_id = 1",
+    ])
+    def test_file_id_lookups_use_an_index(self, sql: str) -> None:
+        # The foreign keys to `file` don't need their own indexes: the unique
+        # constraints (or primary key) already start with file_id.
+        plan = query_plan(sql)
+        assert plan[0].startswith("SEARCH ")
+        assert re.search(r"USING (COVERING INDEX|INDEX|INTEGER PRIMARY KEY)", plan[0])
+
+    @pytest.mark.parametrize("sql", [
+        "select distinct fromno, tono from arc where file_id = 1",
+        "select distinct fromno, tono from arc where file_id = 1 and context_id in (1, 2)",
+        "select fromno, tono, context_id from arc where file_id = 1",
+    ])
+    def test_arc_lookups_use_a_covering_index(self, sql: str) -> None:
+        # The arc table's unique constraint has every column, so per-file arc
+        # queries never need to read the table itself.  Older SQLite versions
+        # say "SEARCH TABLE arc".
+        plan = query_plan(sql)
+        assert re.search(r"^SEARCH (TABLE )?arc USING COVERING INDEX", plan[0])
+
 
 class CoverageDataInTempDirTest(CoverageTest):
     """Tests of CoverageData that need a temporary directory to make files."""
@@ -647,6 +914,20 @@ class CoverageDataInTempDirTest(CoverageTest):
         covdata2.read()
         assert_arcs3_data(covdata2)
 
+    def test_file_added_by_someone_else(self) -> None:
+        # A file row added by another writer keeps its id, so its data isn't
+        # orphaned when we add the same file.
+        covdata1 = DebugCoverageData("shared.dat")
+        covdata1.add_lines(LINES_1)
+        covdata2 = DebugCoverageData("shared.dat")
+        covdata2.read()
+        covdata1.add_lines({"c.py": {17}})
+        covdata2.add_lines({"c.py": {18}, "a.py": {3}})
+
+        covdata3 = DebugCoverageData("shared.dat")
+        covdata3.read()
+        assert_line_counts(covdata3, {"a.py": 3, "b.py": 1, "c.py": 2})
+
     def test_read_errors(self) -> None:
         self.make_file("xyzzy.dat", "xyzzy")
         with pytest.raises(DataError, match=r"Couldn't .* '.*[/\\]xyzzy.dat': \S+"):
@@ -817,6 +1098,11 @@ class CoverageDataFilesTest(CoverageTest):
         self.assert_file_count("datafile.*", 0)
         self.assert_exists(".coverage")
 
+    def test_erasing_parallel_in_missing_directory(self) -> None:
+        data = DebugCoverageData("nothere/datafile")
+        data.erase(parallel=True)
+        self.assert_doesnt_exist("nothere")
+
     def test_combining_with_aliases(self) -> None:
         covdata1 = DebugCoverageData(suffix='1')
         covdata1.add_lines({
@@ -10,6 +10,8 @@ import sqlite3
 
 from typing import Iterable
 
+import pytest
+
 from hypothesis import example, given, settings
 from hypothesis.strategies import sets, integers
 
@@ -52,6 +54,15 @@ class NumbitsOpTest(CoverageTest):
         nums2 = numbits_to_nums(numbits)
         assert nums == set(nums2)
 
+    @pytest.mark.parametrize("nums", [
+        set(range(1, 200)),         # dense
+        {1, 20000, 40000},          # sparse
+    ])
+    def test_conversion_dense_and_sparse(self, nums: set[int]) -> None:
+        numbits = nums_to_numbits(nums)
+        good_numbits(numbits)
+        assert set(numbits_to_nums(numbits)) == set(nums)
+
     @given(line_number_sets, line_number_sets)
     @settings(default_settings)
     def test_union(self, nums1: set[int], nums2: set[int]) -> None:
@@ -74,6 +74,29 @@ class SqliteDbTest(CoverageTest):
                         [("vincent", "van gogh")],
                     )
 
+    def test_insert_many_void(self) -> None:
+        debug = DebugControlString(options=["sql"])
+        with SqliteDb("test.db", debug) as db:
+            db.executescript(DB_INIT)
+            names = [(f"first{i}", f"last{i}") for i in range(1000)]
+            db.insert_many_void("insert into name (first, last)", names)
+            with db.execute("select count(*) from name") as cur:
+                assert list(cur) == [(1001,)]
+        # 1000 two-value rows need three statements to stay under 999 parameters.
+        assert debug.get_output().count("Executing 'insert into name") == 3
+
+    def test_retry_insert_many_void(self) -> None:
+        with SqliteDb("test.db", DebugControlString(options=["sql"])) as db:
+            db.executescript(DB_INIT)
+            proxy = FailingProxy(db.con, "execute", [Exception("WUT")])
+            with mock.patch.object(db, "con", proxy):
+                db.insert_many_void(
+                    "insert into name (first, last)",
+                    [("vincent", "van gogh")],
+                )
+            with db.execute("select first from name order by 1") as cur:
+                assert list(cur) == [("pablo",), ("vincent",)]
+
     def test_open_fails_on_bad_db(self) -> None:
         self.make_file("bad.db", "boogers")
         def fake_failing_open(filename: str, mode: str) -> NoReturn:
@@ -100,3 +123,14 @@ class SqliteDbTest(CoverageTest):
                 msg = "Couldn't use data file 'fail.db': no such table: nosuchtable"
                 with pytest.raises(DataError, match=msg):
                     db.execute_void("select x from nosuchtable", fail_ok=False)
+
+    def test_write_pragmas(self) -> None:
+        with SqliteDb("pragmas.db", DebugControlString(options=["sql"])) as db:
+            with db.execute("pragma journal_mode") as cur:
+                assert list(cur) == [("off",)]
+            with db.execute("pragma synchronous") as cur:
+                assert list(cur) == [(0,)]
+            with db.execute("pragma temp_store") as cur:
+                assert list(cur) == [(2,)]
+        # We don't want any journal files left behind.
+        self.assert_file_count("pragmas.db*", 1)